@@ -33,25 +33,48 @@ def load_jupyter_server_extension(nb_server_app):
     Args:
         nb_server_app (NotebookApp): handle to the Notebook webserver instance.
     """
+    import os, sqlite3
+
     from jupyter_server.utils import url_path_join
 
     from .build import LatexBuildHandler
+    from .config import LatexConfig
+    from .history import (BuildHistory, BuildScheduler, LatexHistoryHandler,
+                          default_history_file)
     from .synctex import LatexSynctexHandler
 
+    c = LatexConfig(config=nb_server_app.config)
+    try:
+        build_history = BuildHistory(c.history_file or default_history_file())
+    except (OSError, sqlite3.Error) as e:
+        # Builds work without a history, only without predictions.
+        nb_server_app.log.warning(
+            f"jupyterlab-latex: build history disabled: {e}")
+        build_history = None
+    scheduler = BuildScheduler(c.max_concurrent_builds or os.cpu_count() or 1)
+
     web_app = nb_server_app.web_app
     # Prepend the base_url so that it works in a jupyterhub setting
     base_url = web_app.settings['base_url']
     latex = url_path_join(base_url, 'latex')
     build = url_path_join(latex, 'build')
     synctex = url_path_join(latex, 'synctex')
+    history = url_path_join(latex, 'history')
 
     handlers = [(f'{build}{path_regex}',
                  LatexBuildHandler,
-                 {"root_dir": nb_server_app.root_dir}
+                 {"root_dir": nb_server_app.root_dir,
+                  "history": build_history,
+                  "scheduler": scheduler}
                 ),
                 (f'{synctex}{path_regex}',
                  LatexSynctexHandler,
                  {"root_dir": nb_server_app.root_dir}
+                 ),
+                (f'{history}{path_regex}',
+                 LatexHistoryHandler,
+                 {"root_dir": nb_server_app.root_dir,
+                  "history": build_history}
                  )]
     web_app.add_handlers('.*$', handlers)
 
@@ -1,6 +1,6 @@
 """ JupyterLab LaTex : live LaTeX editing for JupyterLab """
 
-import glob, json, re, os
+import glob, json, re, os, tempfile, time
 from contextlib import contextmanager
 import shutil
 
@@ -8,7 +8,13 @@ from tornado import gen, web
 
 from jupyter_server.base.handlers import APIHandler
 
+from .chapters import aux_files, enclosing_unit, find_units, input_files
 from .config import LatexConfig
+from .figures import (FigureCache, compile_figure, default_cache_dir,
+                      figure_body_key, figure_document, figure_executor,
+                      figure_hook, figure_key, find_figures, hold_figures,
+                      release_figures)
+from .history import predict_build, record_build, typical_duration
 from .util import run_command
 
 @contextmanager
@@ -64,11 +70,26 @@ class LatexBuildHandler(APIHandler):
     A handler that runs LaTeX on the server.
     """
 
-    def initialize(self, root_dir):
+    def initialize(self, root_dir, history, scheduler):
         self.root_dir = root_dir
+        self.history = history
+        self.scheduler = scheduler
+        self.passes = 0
+        self.figure_keys = []
 
 
-    def build_tex_cmd_sequence(self, tex_base_name):
+    def shell_escape_flag(self):
+        """Returns the command-line flag for the `shell_escape` setting."""
+        c = LatexConfig(config=self.config)
+        if c.shell_escape == 'allow':
+            return '-shell-escape'
+        elif c.shell_escape == 'disallow':
+            return '-no-shell-escape'
+        elif c.shell_escape == 'restricted':
+            return '-shell-restricted'
+        return ''
+
+    def build_tex_cmd_sequence(self, tex_base_name, hook=None, unit=None):
         """Builds tuples that will be used to call LaTeX shell commands.
 
         Parameters
@@ -76,6 +97,14 @@ class LatexBuildHandler(APIHandler):
         tex_base_name: string
             This is the name of the tex file to be compiled, without its
             extension.
+        hook: string or None, optional
+            The path of a file to `\\input` ahead of the document to
+            substitute cached figures, as written by `run_figures`.
+            Defaults to None.
+        unit: string or None, optional
+            The only `\\include`d unit to compile, as returned by
+            `build_unit`, in which case a single LaTeX pass is run.
+            Defaults to None.
 
         returns:
             A list of tuples of strings to be passed to
@@ -86,13 +115,7 @@ class LatexBuildHandler(APIHandler):
         
         engine_name = c.latex_command
 
-        escape_flag = ''
-        if c.shell_escape == 'allow':
-            escape_flag = '-shell-escape'
-        elif c.shell_escape == 'disallow':
-            escape_flag = '-no-shell-escape'
-        elif c.shell_escape == 'restricted':
-            escape_flag = '-shell-restricted'
+        escape_flag = self.shell_escape_flag()
 
         # Get the synctex query parameter, defaulting to
         # 1 if it is not set or is invalid.
@@ -116,6 +139,18 @@ class LatexBuildHandler(APIHandler):
             )
         else:
             self.log.info("Using TeX Live (or compatible distribution) for LaTeX compilation.")
+            prefix = ''
+            if hook:
+                prefix += f"\\input{{{hook}}}"
+            if unit:
+                prefix += f"\\includeonly{{{unit}}}"
+            if prefix:
+                input_sequence = (
+                    f"-jobname={tex_base_name}",
+                    f"{prefix}\\input{{{tex_base_name}}}",
+                )
+            else:
+                input_sequence = (f"{tex_base_name}",)
             full_latex_sequence = (
                 engine_name,
                 escape_flag,
@@ -123,11 +158,16 @@ class LatexBuildHandler(APIHandler):
                 "-halt-on-error",
                 "-file-line-error",
                 f"-synctex={'1' if synctex else '0'}",
-                f"{tex_base_name}",
+                *input_sequence,
             )
         
         command_sequence = [full_latex_sequence]
 
+        # A single unit is built with the bibliography and the references
+        # of the last full build, so one pass is enough.
+        if unit:
+            return command_sequence
+
         # Skip bibtex compilation if the following conditions are present
         #   - c.LatexConfig.disable_bibtex is explicitly set to True
         #   - tectonic engine is used
@@ -149,6 +189,33 @@ class LatexBuildHandler(APIHandler):
         
         return command_sequence
 
+    def plan_passes(self, command_sequence, passes):
+        """Determines how many LaTeX passes to add to a command sequence.
+
+        Parameters
+        ----------
+        command_sequence: list of tuples of strings
+            The sequence returned by `build_tex_cmd_sequence`, whose first
+            command is the LaTeX pass.
+        passes: int or None
+            How many LaTeX passes the document needed to settle in its last
+            successful build, from the build history.
+
+        Returns
+        -------
+        int
+            The number of LaTeX passes to append to the sequence so that it
+            runs `passes` of them, up to `max_passes`. `run_latex` skips them
+            once LaTeX stops asking for a rerun.
+
+        """
+        c = LatexConfig(config=self.config)
+        # Tectonic reruns the engine on its own.
+        if not passes or c.latex_command == 'tectonic' or c.manual_cmd_args:
+            return 0
+        planned = command_sequence.count(command_sequence[0])
+        return max(min(passes, c.max_passes) - planned, 0)
+
     def bib_condition(self):
         """Determines whether BiBTeX should be run.
 
@@ -160,6 +227,93 @@ class LatexBuildHandler(APIHandler):
         """
         return any([re.match(r'.*\.bib', x) for x in set(glob.glob("*"))])
 
+    def build_unit(self, tex_file_path, units):
+        """Determines which `\\include`d unit to compile on its own.
+
+        The unit is the one enclosing the cursor, given by the `cursor_file`
+        (relative to the root directory) and `cursor_line` query arguments.
+
+        Parameters
+        ----------
+        tex_file_path: string
+            The path to the main `.tex` file.
+        units: list of tuples
+            The units of the document, as returned by `find_units`.
+
+        Returns
+        -------
+        string or None
+            The name of the unit, or None if the whole document should be
+            compiled: when there is no cursor or it is outside any unit,
+            when the engine cannot build a single unit, or when the
+            auxiliary files of a previous full build are missing.
+
+        """
+        c = LatexConfig(config=self.config)
+        cursor_file = self.get_query_argument('cursor_file', default=None)
+        if (cursor_file is None or not units or c.manual_cmd_args
+                or c.latex_command == 'tectonic'):
+            return None
+        try:
+            cursor_line = int(self.get_query_argument('cursor_line', default='0'))
+        except ValueError:
+            return None
+
+        workdir = os.path.dirname(tex_file_path)
+        unit = enclosing_unit(tex_file_path, units,
+                              os.path.join(self.root_dir, cursor_file.strip('/')),
+                              cursor_line, workdir)
+        if unit is None:
+            return None
+
+        # The numbering and references of the other units are read from
+        # the auxiliary files they wrote during the last full build.
+        tex_base_name = os.path.splitext(os.path.basename(tex_file_path))[0]
+        needed = [tex_base_name + '.aux'] + [
+            os.path.splitext(name)[0] + '.aux' for name, _ in units if name != unit]
+        missing = [f for f in needed if not os.path.exists(os.path.join(workdir, f))]
+        if missing:
+            self.log.info((f"jupyterlab-latex: building all of `{tex_file_path}` "
+                           f"since {', '.join(missing)} are missing."))
+            return None
+        return unit
+
+    def cursor_outside(self, tex_file_path):
+        """Determines whether the cursor is in a file the document does not read.
+
+        Returns
+        -------
+        boolean
+            true if a `cursor_file` query argument is given, and it is
+            neither the main `.tex` file nor one of the files it `\\input`s
+            or `\\include`s, in which case there is nothing to rebuild.
+
+        """
+        cursor_file = self.get_query_argument('cursor_file', default=None)
+        if cursor_file is None:
+            return False
+        cursor_file = os.path.abspath(
+            os.path.join(self.root_dir, cursor_file.strip('/')))
+        return cursor_file not in input_files(tex_file_path,
+                                              os.path.dirname(tex_file_path))
+
+    def rerun_condition(self, tex_base_name):
+        """Determines whether LaTeX asked for another pass.
+
+        Returns
+        -------
+        boolean
+            true if the `.log` file of the last pass asks for a rerun,
+            e.g. because cross-references changed.
+
+        """
+        try:
+            with open(f'{tex_base_name}.log', encoding='utf-8', errors='replace') as f:
+                log = f.read()
+        except FileNotFoundError:
+            return False
+        return re.search(r'Rerun to get|Label\(s\) may have changed|Please rerun', log) is not None
+
     def filter_output(self, latex_output):
         """Filters latex output for "interesting" messages
 
@@ -245,7 +399,98 @@ class LatexBuildHandler(APIHandler):
         return '\n'.join(filtered_output)
 
     @gen.coroutine
-    def run_latex(self, command_sequence):
+    def run_figures(self, tex_base_name, cache, unit=None):
+        """Compile the figures of a document that are not in the figure cache.
+
+        Each `tikzpicture` environment is hashed together with the preamble,
+        the data files it reads and the LaTeX command. Stale figures are
+        compiled in parallel on the figure process pool, using the same
+        `shell_escape` setting as the document, and a file is written which
+        makes the main passes include the cached figures instead of
+        typesetting them. The file is written to the cache directory, so
+        that no file of the user is overwritten, and must be removed by the
+        caller, which must also release the figures it includes, stored in
+        `self.figure_keys`, with `release_figures`. Figures which fail to compile on their own are left to the
+        main passes, which report any error.
+
+        Parameters
+        ----------
+        tex_base_name: string
+            This is the name of the tex file to be compiled, without its
+            extension.
+        cache: FigureCache
+            The cache in which the compiled figures are stored.
+        unit: string or None, optional
+            The only `\\include`d unit being compiled, whose figures are
+            the only ones included. Defaults to None.
+
+        Returns
+        -------
+        string or None
+            The path of the file to pass to `build_tex_cmd_sequence`, or
+            None if no figure is cached.
+
+        """
+        c = LatexConfig(config=self.config)
+        preamble, context, figures = find_figures(
+            f'{tex_base_name}.tex', includeonly=[unit] if unit else None)
+        if not figures:
+            return None
+
+        cmd = (
+            c.latex_command,
+            self.shell_escape_flag(),
+            "-interaction=nonstopmode",
+            "-halt-on-error",
+            "-file-line-error",
+        )
+        keys = [figure_key(context, source, " ".join(cmd))
+                for _, _, source in figures]
+        # Keep other builds from pruning these figures until `get` is done.
+        hold_figures(keys)
+        self.figure_keys = keys
+
+        executor = figure_executor(c.figure_cache_workers)
+        futures = {}
+        for key, (_, _, source) in zip(keys, figures):
+            if key in futures or key in cache:
+                continue
+            futures[key] = executor.submit(compile_figure, cmd,
+                                           figure_document(preamble, source),
+                                           os.getcwd(), cache.path(key))
+        self.log.debug((f'jupyterlab-latex: compiling {len(futures)} of '
+                        f'{len(figures)} figures (CWD: {os.getcwd()})'))
+
+        for future in futures.values():
+            try:
+                code, output = yield future
+            except Exception as e:
+                # E.g. a missing engine or an unwritable cache directory.
+                self.log.warning((f'LaTeX command `{" ".join(cmd)}` '
+                                  f'failed on a figure: {e}; '
+                                  'it is typeset with the document instead.'))
+                continue
+            if code != 0:
+                self.log.warning((f'LaTeX command `{" ".join(cmd)}` '
+                                  f'errored with code: {code} on a figure; '
+                                  'it is typeset with the document instead.'))
+                self.log.debug(self.filter_output(output))
+        cache.prune(keep=keys)
+
+        cached = [(name, line, figure_body_key(source), cache.path(key))
+                  for key, (name, line, source) in zip(keys, figures)
+                  if os.path.exists(cache.path(key))]
+        if not cached:
+            return None
+        fd, hook = tempfile.mkstemp(prefix='hook-', suffix='.tex',
+                                    dir=cache.directory)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(figure_hook(cached))
+        # TeX reads forward slashes on every platform.
+        return hook.replace(os.sep, '/')
+
+    @gen.coroutine
+    def run_latex(self, command_sequence, tex_base_name=None, optional=0):
         """Run commands sequentially, returning a 500 code on an error.
 
         Parameters
@@ -255,6 +500,15 @@ class LatexBuildHandler(APIHandler):
             `tornado.process.Subprocess`, which are to be run sequentially.
             On Windows, `tornado.process.Subprocess` is unavailable, so
             we use the synchronous `subprocess.run`.
+        tex_base_name: string or None, optional
+            The name of the tex file being compiled, without its extension.
+            When given, the log is checked for a rerun request after each
+            LaTeX pass, and the number of passes the document needed to
+            settle is stored in `self.passes`. Defaults to None.
+        optional: int, optional
+            The number of trailing LaTeX passes, planned by `plan_passes`,
+            which are skipped once LaTeX stops asking for a rerun.
+            Defaults to 0.
 
         Returns
         -------
@@ -267,8 +521,16 @@ class LatexBuildHandler(APIHandler):
           there.
 
         """
-
-        for cmd in command_sequence:
+        c = LatexConfig(config=self.config)
+        # The LaTeX passes run so far, and the pass after which the log
+        # stopped asking for a rerun. BibTeX changes the bibliography, so
+        # the document has to settle again after it.
+        latex_passes, settled = 0, None
+
+        for i, cmd in enumerate(command_sequence):
+            if i >= len(command_sequence) - optional and settled is not None:
+                self.log.debug(f'jupyterlab-latex: skipping {len(command_sequence) - i} passes')
+                break
             self.log.debug(f'jupyterlab-latex: run: {" ".join(cmd)} (CWD: {os.getcwd()})')
 
             code, output = yield run_command(cmd)
@@ -278,6 +540,20 @@ class LatexBuildHandler(APIHandler):
                                  f'errored with code: {code}'))
                 return json.dumps({'fullMessage':output, 'errorOnlyMessage':self.filter_output(output)})
 
+            if tex_base_name is None:
+                continue
+            if cmd[0] == c.bib_command:
+                settled = None
+            else:
+                latex_passes += 1
+                if self.rerun_condition(tex_base_name):
+                    settled = None
+                elif settled is None:
+                    settled = latex_passes
+
+        if tex_base_name is not None:
+            # Plan one more pass next time if these were not enough.
+            self.passes = settled or min(latex_passes + 1, c.max_passes)
         return "LaTeX compiled"
 
 
@@ -286,6 +562,13 @@ class LatexBuildHandler(APIHandler):
     def get(self, path = ''):
         """
         Given a path, run LaTeX, cleanup, and respond when done.
+
+        With the `keep_aux` query argument, the auxiliary files are kept
+        so that later builds can compile a single `\\include`d unit, which
+        is done when a `cursor_file` and `cursor_line` inside one are given.
+        The `X-LaTeX-Build` response header tells whether the `full`
+        document or a single `unit` was built, or whether the build was
+        `skipped` since the `cursor_file` is not part of the document.
         """
         # Parse the path into the base name and extension of the file
         tex_file_path = os.path.join(self.root_dir, path.strip('/'))
@@ -302,13 +585,85 @@ class LatexBuildHandler(APIHandler):
             self.set_status(400)
             out = (f"The file at `{tex_file_path}` does not end with .tex. "
                     "You can only run LaTeX on a file ending with .tex.")
+        elif self.cursor_outside(tex_file_path):
+            self.set_header('X-LaTeX-Build', 'skipped')
+            out = "LaTeX build skipped; the cursor file is not part of the document."
         else:
-            with latex_cleanup(
-                cleanup=c.cleanup,
-                workdir=os.path.dirname(tex_file_path),
-                whitelist=[tex_base_name+'.pdf', tex_base_name+'.synctex.gz'],
-                greylist=[tex_base_name+'.aux']
-                ):
-                cmd_sequence = self.build_tex_cmd_sequence(tex_base_name)
-                out = yield self.run_latex(cmd_sequence)
+            engine = c.manual_cmd_args[0] if c.manual_cmd_args else c.latex_command
+            prediction = yield predict_build(self.history, tex_file_path,
+                                             engine, self.log)
+            expected = prediction['duration']
+            if expected is None:
+                # Documents without a history are neither put ahead of
+                # nor behind the others.
+                expected = yield typical_duration(self.history, self.log)
+            expected = expected or 0
+
+            workdir = os.path.dirname(tex_file_path)
+            whitelist = [tex_base_name+'.pdf', tex_base_name+'.synctex.gz']
+            greylist = [tex_base_name+'.aux']
+            unit = None
+            keep_aux = (self.get_query_argument('keep_aux', default='0') == '1'
+                        or self.get_query_argument('cursor_file', default=None) is not None)
+            if keep_aux:
+                units = find_units(tex_file_path)
+                unit = self.build_unit(tex_file_path, units)
+                whitelist += aux_files(tex_base_name, units)
+                greylist = []
+                if unit:
+                    expected /= len(units)
+            self.set_header('X-LaTeX-Build', 'unit' if unit else 'full')
+            figure_cache = None
+            if (c.figure_cache and not c.manual_cmd_args
+                    and c.latex_command != 'tectonic'):
+                # The cache directory is created before `latex_cleanup`
+                # takes its snapshot, so that it is never cleaned up.
+                figure_cache = FigureCache(
+                    c.figure_cache_dir or default_cache_dir(),
+                    c.figure_cache_size * 1024 * 1024)
+
+            # Wait for a build slot; shorter documents are started first.
+            yield self.scheduler.acquire(expected)
+            started = time.time()
+            passes, bibtex = 0, False
+            hook = None
+            try:
+                with latex_cleanup(
+                    cleanup=c.cleanup,
+                    workdir=workdir,
+                    whitelist=whitelist,
+                    greylist=greylist
+                    ):
+                    if figure_cache is not None:
+                        hook = yield self.run_figures(tex_base_name, figure_cache, unit)
+                    cmd_sequence = self.build_tex_cmd_sequence(
+                        tex_base_name, hook, unit)
+                    optional = 0
+                    if unit is None:
+                        optional = self.plan_passes(cmd_sequence, prediction['passes'])
+                    cmd_sequence += [cmd_sequence[0]] * optional
+                    out = yield self.run_latex(cmd_sequence, tex_base_name, optional)
+                    bibtex = any(cmd[0] == c.bib_command for cmd in cmd_sequence)
+                    passes = self.passes
+                    # A failed pass, halted part way, can leave auxiliary
+                    # files that break the next builds; drop them so that
+                    # the next build starts over with the whole document.
+                    if keep_aux and self.get_status() != 200:
+                        for fn in aux_files(tex_base_name, units):
+                            try:
+                                os.remove(fn)
+                            except FileNotFoundError:
+                                pass
+            finally:
+                if hook is not None:
+                    os.remove(hook)
+                release_figures(self.figure_keys)
+                self.scheduler.release()
+            # Builds of a single unit would skew the predictions for the
+            # whole document, so they are not recorded.
+            if unit is None:
+                yield record_build(self.history, tex_file_path, engine,
+                                   started, time.time() - started, passes,
+                                   bibtex, self.get_status() == 200,
+                                   log=self.log)
         self.finish(out)
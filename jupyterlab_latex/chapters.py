@@ -0,0 +1,81 @@
+""" JupyterLab LaTex : live LaTeX editing for JupyterLab """
+
+import os, re
+
+from .util import mask_comments, tex_path, walk_tex
+
+_include = re.compile(r'\\include\{([^}]+)\}')
+
+def find_units(tex_file_path):
+    """
+    Find the `\\include`d units of a document.
+
+    Parameters
+    ----------
+    tex_file_path: string
+        The path to the main `.tex` file.
+
+    returns:
+        A list of (name, line) tuples in document order, where name is the
+        argument of `\\include` (the unit name given to `\\includeonly`) and
+        line is the one-based line of the main file it appears on.
+    """
+    with open(tex_file_path, encoding='utf-8', errors='replace') as f:
+        source = mask_comments(f.read())
+    return [(match.group(1).strip(), source.count('\n', 0, match.start()) + 1)
+            for match in _include.finditer(source)]
+
+def input_files(tex_file_path, workdir='.'):
+    """
+    The absolute paths of a `.tex` file and of all the files it `\\input`s
+    or `\\include`s, recursively.
+    """
+    if not os.path.isfile(tex_file_path):
+        return {os.path.abspath(tex_file_path)}
+    return {path for path, _, _ in walk_tex(tex_file_path, workdir)}
+
+def enclosing_unit(tex_file_path, units, cursor_file, cursor_line, workdir='.'):
+    """
+    Find the `\\include`d unit containing a cursor position.
+
+    Parameters
+    ----------
+    tex_file_path: string
+        The path to the main `.tex` file.
+
+    units: list of tuples
+        The units of the document, as returned by `find_units`.
+
+    cursor_file: string
+        The path of the file the cursor is in.
+
+    cursor_line: int
+        The one-based line the cursor is on.
+
+    workdir: string, optional
+        The directory LaTeX runs in (the default is '.').
+
+    returns:
+        The name of the unit, or None if the cursor is not inside one, e.g.
+        when it is in the main file anywhere but on an `\\include` line.
+    """
+    cursor_file = os.path.abspath(cursor_file)
+    if cursor_file == os.path.abspath(tex_file_path):
+        for name, line in units:
+            if line == cursor_line:
+                return name
+        return None
+    for name, _ in units:
+        if cursor_file in input_files(tex_path(name, workdir), workdir):
+            return name
+    return None
+
+def aux_files(tex_base_name, units):
+    """
+    The auxiliary files a build restricted to one unit with `\\includeonly`
+    reads to keep the numbering and references of the other units.
+    """
+    files = [tex_base_name + ext
+             for ext in ('.aux', '.bbl', '.toc', '.lof', '.lot', '.out')]
+    files += [os.path.splitext(name)[0] + '.aux' for name, _ in units]
+    return files
@@ -32,3 +32,22 @@ class LatexConfig(Configurable):
     manual_cmd_args = TraitletsList(Unicode(), default_value=[], config=True,
         help='A list of user-defined command-line arguments with placeholders for ' +
              'filename ({filename})')
+    figure_cache = Bool(default_value=False, config=True,
+        help='Whether to compile "tikzpicture" environments separately and ' +
+             'reuse them across builds until their source changes.')
+    figure_cache_dir = Unicode('', config=True,
+        help='The directory of the figure cache. Defaults to ' +
+             '"latex/figures" in the Jupyter data directory.')
+    figure_cache_size = Integer(default_value=256, config=True,
+        help='The maximum size of the figure cache, in megabytes.')
+    figure_cache_workers = Integer(default_value=0, config=True,
+        help='How many figures to compile in parallel. ' +
+             '0 uses the number of CPUs.')
+    history_file = Unicode('', config=True,
+        help='The SQLite database in which past builds are recorded. ' +
+             'Defaults to "latex/history.sqlite" in the Jupyter data directory.')
+    max_concurrent_builds = Integer(default_value=0, config=True,
+        help='How many documents to build at once; waiting builds start ' +
+             'shortest expected first. 0 uses the number of CPUs.')
+    max_passes = Integer(default_value=5, config=True,
+        help='The maximum number of LaTeX passes planned from the build history.')
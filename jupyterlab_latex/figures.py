@@ -0,0 +1,378 @@
+""" JupyterLab LaTex : live LaTeX editing for JupyterLab """
+
+import hashlib, itertools, os, re, shutil, subprocess, tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from jupyter_core.paths import jupyter_data_dir
+
+from .util import mask_comments, walk_tex
+
+_figure = re.compile(r'\\begin\{tikzpicture\}.*?\\end\{tikzpicture\}',
+                     re.DOTALL)
+_data = re.compile(r'(?:\\input|\\includegraphics\s*(?:\[[^\]]*\])?|'
+                   r'\btable\s*(?:\[[^\]]*\])?|\bfile\s*(?:\[[^\]]*\])?)'
+                   r'\s*\{([^}]+)\}')
+_data_exts = ('', '.tex', '.pdf', '.png', '.jpg', '.csv', '.dat', '.txt')
+
+_executor = None
+# The figures used by the builds in progress, which pruning must keep.
+_in_use = Counter()
+
+def figure_executor(max_workers=None):
+    """
+    Return the process pool shared by all builds for compiling figures.
+    The pool is created on first use.
+
+    Parameters
+    ----------
+    max_workers: int or None
+        The number of worker processes. None uses the number of CPUs.
+
+    returns:
+        A `concurrent.futures.ProcessPoolExecutor`.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max_workers or None)
+    return _executor
+
+def default_cache_dir():
+    """
+    The default location of the figure cache, in the Jupyter data directory.
+    """
+    return os.path.join(jupyter_data_dir(), 'latex', 'figures')
+
+def find_figures(tex_file_path, workdir='.', includeonly=None):
+    """
+    Find the `tikzpicture` environments written out in the body of a
+    LaTeX document and in the files it `\\input`s or `\\include`s there.
+
+    Parameters
+    ----------
+    tex_file_path: string
+        The path to the main `.tex` file.
+
+    workdir: string, optional
+        The directory LaTeX runs in (the default is '.').
+
+    includeonly: list of strings or None, optional
+        If given, the `\\include`d units not in this list are skipped.
+
+    returns:
+        A tuple of (preamble, context, figures), where preamble is the
+        preamble of the main file, context is the preamble together with
+        the files it reads, and figures is a list of (name, line, source)
+        tuples giving the file name, the one-based line of
+        `\\begin{tikzpicture}` and the source of each environment.
+        If the document has no body, figures is empty.
+    """
+    with open(tex_file_path, encoding='utf-8', errors='replace') as f:
+        raw = f.read()
+    body = mask_comments(raw).find('\\begin{document}')
+    if body < 0:
+        return (raw, raw, [])
+    preamble = raw[:body]
+    # The body of the main file is left out, so that editing the text
+    # around the figures does not change their keys.
+    files = list(walk_tex(tex_file_path, workdir, end=body))
+    context = preamble + ''.join(raw for _, raw, _ in files[1:])
+    figures = []
+    for path, raw, masked in walk_tex(tex_file_path, workdir, includeonly,
+                                      start=body):
+        for match in _figure.finditer(masked):
+            line = masked.count('\n', 0, match.start()) + 1
+            figures.append((os.path.basename(path), line,
+                            raw[match.start():match.end()]))
+    return (preamble, context, figures)
+
+def detokenize(source):
+    """
+    Approximate how `\\detokenize` prints the tokens TeX reads from
+    `source` with the usual category codes: comments are dropped, runs of
+    spaces and line ends become one space, control words are followed by a
+    space, empty lines become `\\par` and `#` is doubled.
+    """
+    out = []
+    for text in source.split('\n'):
+        text = text.rstrip(' \t')
+        # States as in TeX: N at the start of a line, M in the middle,
+        # S when skipping blanks.
+        state, i = 'N', 0
+        while i < len(text):
+            char = text[i]
+            if char == '%':
+                break
+            if char in ' \t':
+                if state == 'M':
+                    out.append(' ')
+                    state = 'S'
+                i += 1
+            elif char == '\\' and i + 1 < len(text):
+                j = i + 1
+                while j < len(text) and text[j].isascii() and text[j].isalpha():
+                    j += 1
+                if j > i + 1:
+                    out.append(text[i:j] + ' ')
+                    state = 'S'
+                else:
+                    j = i + 2
+                    out.append(text[i:j])
+                    state = 'S' if text[i + 1] == ' ' else 'M'
+                i = j
+            else:
+                out.append('##' if char == '#' else char)
+                state = 'M'
+                i += 1
+        else:
+            # The line end was reached without a comment.
+            if state == 'N':
+                out.append('\\par ')
+            elif state == 'M':
+                out.append(' ')
+    return ''.join(out)
+
+def figure_body_key(figure):
+    """
+    The key under which the LaTeX code of `figure_hook` looks up a figure:
+    the upper-case MD5 digest of its detokenized body, as computed by
+    `\\pdf@mdfivesum`.
+    """
+    tokens = detokenize(figure)
+    begin, end = '\\begin {tikzpicture}', '\\end {tikzpicture}'
+    body = tokens[len(begin):tokens.rindex(end)]
+    return hashlib.md5(body.encode('utf-8')).hexdigest().upper()
+
+def figure_dependencies(figure, workdir='.'):
+    """
+    The paths of the existing files a figure reads, such as pgfplots
+    `table` data, `\\input` files and included graphics.
+    """
+    paths = []
+    for match in _data.finditer(mask_comments(figure)):
+        name = os.path.join(workdir, match.group(1).strip())
+        for ext in _data_exts:
+            if os.path.isfile(name + ext):
+                paths.append(name + ext)
+                break
+    return paths
+
+def figure_key(context, figure, salt='', workdir='.'):
+    """
+    Hash a figure together with everything it is compiled from.
+
+    Parameters
+    ----------
+    context: string
+        The preamble of the document containing the figure, with the files
+        it reads, as returned by `find_figures`.
+
+    figure: string
+        The source of the `tikzpicture` environment.
+
+    salt: string, optional
+        Anything else that changes the output, such as the engine.
+
+    workdir: string, optional
+        The directory against which the data files read by the figure
+        are resolved (the default is '.').
+
+    returns:
+        A hexadecimal digest naming the figure in the cache.
+    """
+    digest = hashlib.sha256()
+    for part in (salt, context, figure):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    for path in figure_dependencies(figure, workdir):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def figure_document(preamble, figure):
+    """
+    Build a document that typesets a single figure, cropped to its bounding
+    box with the `preview` package, using the preamble of its parent.
+    """
+    return (f"{preamble}\n"
+            "\\usepackage[active,tightpage]{preview}\n"
+            "\\PreviewEnvironment{tikzpicture}\n"
+            "\\begin{document}\n"
+            f"{figure}\n"
+            "\\end{document}\n")
+
+def figure_hook(figures):
+    """
+    Build the LaTeX code that is `\\input` ahead of the document to include
+    cached figures in place of its `tikzpicture` environments.
+
+    Only `\\begin{tikzpicture}` at one of the given positions is intercepted,
+    so `\\tikz`, and environments or macros that start a `tikzpicture`
+    themselves, are left alone. The body of an intercepted environment is
+    then looked up by content, and is typeset as usual if no cached figure
+    matches it.
+
+    Parameters
+    ----------
+    figures: list of tuples
+        The (name, line, key, path) of each cached figure, where name and
+        line are its position as returned by `find_figures`, key is its
+        `figure_body_key` and path is the compiled PDF.
+
+    returns:
+        The LaTeX code as a string.
+    """
+    lines = [
+        "\\makeatletter",
+        "\\newif\\ifjll@inpicture",
+        "\\def\\jll@figureat#1{\\expandafter\\let\\csname jll@figureat@#1\\endcsname\\@empty}",
+        "\\def\\jll@figure#1#2{\\expandafter\\def\\csname jll@figure@#1\\endcsname{#2}}",
+    ]
+    for name, line, key, path in figures:
+        # File names that TeX cannot read back as text are never matched.
+        if re.search(r'[\\{}%#~^$&]', name):
+            continue
+        path = path.replace(os.sep, '/')
+        lines.append(f"\\jll@figureat{{{name}:{line}}}")
+        lines.append(f"\\jll@figure{{{key}}}{{{path}}}")
+    lines += [
+        "\\def\\jll@begintikzpicture{%",
+        "  \\ifjll@inpicture\\else",
+        "    \\@ifundefined{jll@figureat@\\CurrentFile:\\the\\inputlineno}{}{%",
+        "      \\jll@inpicturetrue",
+        "      \\let\\tikzpicture\\jll@collecttikzpicture}%",
+        "  \\fi}",
+        "\\def\\jll@collecttikzpicture{\\Collect@Body\\jll@cachedfigure}",
+        "\\long\\def\\jll@cachedfigure#1{%",
+        "  \\let\\tikzpicture\\jll@tikzpicture",
+        "  \\edef\\jll@key{\\pdf@mdfivesum{\\detokenize{#1}}}%",
+        "  \\@ifundefined{jll@figure@\\jll@key}%",
+        "    {\\jll@tikzpicture#1}%",
+        "    {\\let\\endtikzpicture\\relax",
+        "     \\includegraphics{\\csname jll@figure@\\jll@key\\endcsname}}}",
+        "\\def\\jll@usecachedfigures{%",
+        "  \\@ifundefined{tikzpicture}{}{%",
+        "    \\RequirePackage{graphicx}%",
+        "    \\RequirePackage{environ}%",
+        "    \\RequirePackage{pdftexcmds}%",
+        "    \\@ifundefined{pdf@mdfivesum}{}{%",
+        "      \\let\\jll@tikzpicture\\tikzpicture",
+        "      \\AddToHook{env/tikzpicture/begin}{\\jll@begintikzpicture}}}}",
+        "\\AddToHook{begindocument/before}{\\jll@usecachedfigures}",
+        "\\makeatother",
+        "",
+    ]
+    return '\n'.join(lines)
+
+def compile_figure(cmd, source, workdir, target):
+    """
+    Compile a single figure document and move the resulting PDF to `target`.
+    This runs in a worker process of the figure executor.
+
+    Parameters
+    ----------
+    cmd: tuple of strings
+        The LaTeX command, without the output directory and input file.
+
+    source: string
+        The figure document, as returned by `figure_document`.
+
+    workdir: string
+        The directory to run LaTeX in, so that relative paths in the
+        figure (e.g. pgfplots data files) resolve as in the main document.
+
+    target: string
+        Where to store the compiled figure.
+
+    returns:
+        A tuple containing the (return code, stdout)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        tex_path = os.path.join(tmp, 'figure.tex')
+        with open(tex_path, 'w', encoding='utf-8') as f:
+            f.write(source)
+        process = subprocess.run(
+            list(cmd) + [f'-output-directory={tmp}', tex_path],
+            cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        code = process.returncode
+        out = process.stdout.decode('utf-8', errors='replace')
+        if code == 0:
+            partial = f'{target}.{os.getpid()}.part'
+            shutil.move(os.path.join(tmp, 'figure.pdf'), partial)
+            os.replace(partial, target)
+    return (code, out)
+
+def hold_figures(keys):
+    """
+    Mark figures as used by a build in progress, so that no build prunes
+    them from the cache until they are released with `release_figures`.
+    """
+    _in_use.update(keys)
+
+def release_figures(keys):
+    """Release figures marked with `hold_figures`."""
+    _in_use.subtract(keys)
+    for key in set(keys):
+        if _in_use[key] <= 0:
+            del _in_use[key]
+
+class FigureCache:
+    """
+    A size-bounded directory of compiled figures, named by `figure_key`,
+    which is shared by all documents and persists across builds.
+    Figures are evicted least-recently-used first.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Parameters
+        ----------
+        directory: string
+            The cache directory, which is created if it does not exist.
+
+        max_size: int
+            The maximum total size of the cache, in bytes.
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        """The path at which the figure `key` is stored."""
+        return os.path.join(self.directory, key + '.pdf')
+
+    def __contains__(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return False
+        # Mark the figure as recently used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def prune(self, keep=()):
+        """
+        Remove the least recently used figures until the cache fits in
+        `max_size`, never removing the figures in `keep` nor those held
+        by builds in progress.
+        """
+        keep = {self.path(key) for key in itertools.chain(keep, _in_use)}
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pdf') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if path in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,319 @@
+""" JupyterLab LaTex : live LaTeX editing for JupyterLab """
+
+import heapq, itertools, json, logging, os, sqlite3, statistics, time
+from contextlib import closing
+
+from jupyter_core.paths import jupyter_data_dir
+from tornado import gen, web
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from jupyter_server.base.handlers import APIHandler
+
+from .config import LatexConfig
+
+def default_history_file():
+    """
+    The default location of the build history, in the Jupyter data directory.
+    """
+    return os.path.join(jupyter_data_dir(), 'latex', 'history.sqlite')
+
+def empty_prediction():
+    """The prediction for a document without any recorded build."""
+    return {
+        'builds': 0,
+        'duration': None,
+        'passes': None,
+        'bibtex': None,
+        'success': None,
+    }
+
+class BuildHistory:
+    """
+    A persistent record of past builds, stored in an SQLite database,
+    from which the duration and pass plan of the next build are predicted.
+    """
+
+    # How many builds to keep, and to predict from, per document.
+    keep = 50
+    window = 10
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: string
+            The path of the SQLite database, which is created if it does not
+            exist. Its directory is created as well.
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with closing(self.connect()) as db, db:
+            db.execute('''CREATE TABLE IF NOT EXISTS builds (
+                document TEXT NOT NULL,
+                engine TEXT NOT NULL,
+                started REAL NOT NULL,
+                duration REAL NOT NULL,
+                passes INTEGER NOT NULL,
+                bibtex INTEGER NOT NULL,
+                success INTEGER NOT NULL
+            )''')
+            db.execute('''CREATE INDEX IF NOT EXISTS builds_document
+                ON builds (document, started)''')
+
+    def connect(self):
+        """Open a connection to the database."""
+        return sqlite3.connect(self.path, timeout=5)
+
+    def record(self, document, engine, started, duration, passes, bibtex,
+               success):
+        """
+        Record a build, dropping the oldest builds of the document beyond
+        `keep`.
+
+        Parameters
+        ----------
+        document: string
+            The absolute path of the `.tex` file.
+
+        engine: string
+            The LaTeX command the document was built with.
+
+        started: float
+            When the build started, in seconds since the epoch.
+
+        duration: float
+            How long the build took, in seconds.
+
+        passes: int
+            How many LaTeX passes the document needs to settle.
+
+        bibtex: bool
+            Whether BibTeX was run.
+
+        success: bool
+            Whether the build succeeded.
+        """
+        with closing(self.connect()) as db, db:
+            db.execute('INSERT INTO builds VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (document, engine, started, duration, passes,
+                        int(bibtex), int(success)))
+            db.execute('''DELETE FROM builds WHERE document = ? AND rowid NOT IN
+                (SELECT rowid FROM builds WHERE document = ?
+                 ORDER BY started DESC LIMIT ?)''',
+                       (document, document, self.keep))
+
+    def predict(self, document, engine=None):
+        """
+        Predict the next build of a document from its most recent builds.
+
+        Parameters
+        ----------
+        document: string
+            The absolute path of the `.tex` file.
+
+        engine: string or None, optional
+            Only consider builds with this LaTeX command. Defaults to None,
+            which considers all builds.
+
+        returns:
+            A dictionary with the number of recorded `builds`, the predicted
+            `duration` in seconds (the median of recent successful builds),
+            the number of LaTeX `passes` and whether `bibtex` ran in the
+            last successful build, and whether the last build was a
+            `success`. Values that cannot be predicted are None.
+        """
+        query = 'SELECT duration, passes, bibtex, success FROM builds WHERE document = ?'
+        args = [document]
+        if engine is not None:
+            query += ' AND engine = ?'
+            args.append(engine)
+        query += ' ORDER BY started DESC LIMIT ?'
+        args.append(self.window)
+        with closing(self.connect()) as db:
+            rows = db.execute(query, args).fetchall()
+
+        successes = [row for row in rows if row[3]]
+        prediction = empty_prediction()
+        prediction['builds'] = len(rows)
+        if rows:
+            prediction['success'] = bool(rows[0][3])
+        if successes:
+            prediction['duration'] = statistics.median(row[0] for row in successes)
+            prediction['passes'] = successes[0][1]
+            prediction['bibtex'] = bool(successes[0][2])
+        return prediction
+
+    def typical_duration(self):
+        """
+        The median duration of recent successful builds of all documents,
+        in seconds, or None if there are none. It stands in for the
+        expected duration of documents without a history.
+        """
+        with closing(self.connect()) as db:
+            rows = db.execute('''SELECT duration FROM builds WHERE success = 1
+                ORDER BY started DESC LIMIT ?''', (self.keep,)).fetchall()
+        if not rows:
+            return None
+        return statistics.median(row[0] for row in rows)
+
+# The history is optional: a missing or failing database must never fail a
+# build, so errors are logged and an empty prediction is used instead. The
+# queries run on the default executor, since SQLite blocks on disk and on
+# the locks of other servers sharing the database.
+
+@gen.coroutine
+def _query(history, default, log, method, *args):
+    """
+    Call a method of a `BuildHistory` on the default executor, returning
+    `default` if there is no history or the call fails.
+    """
+    if history is None:
+        return default
+    try:
+        result = yield IOLoop.current().run_in_executor(
+            None, getattr(history, method), *args)
+    except (OSError, sqlite3.Error) as e:
+        (log or logging.getLogger(__name__)).warning(
+            f"jupyterlab-latex: cannot use the build history: {e}")
+        return default
+    return result
+
+@gen.coroutine
+def predict_build(history, document, engine=None, log=None):
+    """
+    Predict the next build of a document with `BuildHistory.predict`,
+    off the event loop.
+
+    Parameters
+    ----------
+    history: BuildHistory or None
+        The build history, or None if it is unavailable.
+
+    document, engine:
+        As for `BuildHistory.predict`.
+
+    log: logging.Logger or None, optional
+        Where to report errors. Defaults to the module logger.
+
+    returns:
+        The prediction, or `empty_prediction()` if there is no history or
+        it cannot be read.
+    """
+    prediction = yield _query(history, empty_prediction(), log,
+                              'predict', document, engine)
+    return prediction
+
+@gen.coroutine
+def typical_duration(history, log=None):
+    """
+    Get `BuildHistory.typical_duration` off the event loop, or None if
+    there is no history or it cannot be read.
+    """
+    duration = yield _query(history, None, log, 'typical_duration')
+    return duration
+
+@gen.coroutine
+def record_build(history, *args, log=None):
+    """
+    Record a build with `BuildHistory.record`, off the event loop, logging
+    rather than raising any error.
+
+    Parameters
+    ----------
+    history: BuildHistory or None
+        The build history, or None if it is unavailable.
+
+    args:
+        The arguments of `BuildHistory.record`.
+
+    log: logging.Logger or None, optional
+        Where to report errors. Defaults to the module logger.
+    """
+    yield _query(history, None, log, 'record', *args)
+
+class BuildScheduler:
+    """
+    Limits how many builds run at once. Waiting builds are started
+    shortest expected duration first, so that short documents stay
+    responsive while long ones are building. Builds age while they wait:
+    every second waited counts as a second less of expected duration, so
+    long builds are not starved by a steady stream of short ones.
+    """
+
+    def __init__(self, slots):
+        """
+        Parameters
+        ----------
+        slots: int
+            The maximum number of concurrent builds.
+        """
+        self.slots = max(1, slots)
+        self.running = 0
+        self.waiting = []
+        self.counter = itertools.count()
+
+    @gen.coroutine
+    def acquire(self, expected=0):
+        """
+        Wait for a build slot. Every call must be paired with `release`.
+
+        Parameters
+        ----------
+        expected: float, optional
+            The expected duration of the build, in seconds.
+        """
+        if self.running < self.slots and not self.waiting:
+            self.running += 1
+            return
+        future = Future()
+        # Ordering by expected duration minus time waited is the same, at
+        # any moment, as ordering by expected duration plus arrival time.
+        priority = expected + time.monotonic()
+        heapq.heappush(self.waiting, (priority, next(self.counter), future))
+        yield future
+
+    def release(self):
+        """
+        Give up a build slot, handing it to the shortest waiting build.
+        """
+        if self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            future.set_result(None)
+        else:
+            self.running -= 1
+
+class LatexHistoryHandler(APIHandler):
+    """
+    A handler that reports the predicted next build of a document.
+    """
+
+    def initialize(self, root_dir, history):
+        self.root_dir = root_dir
+        self.history = history
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path = ''):
+        """
+        Given a path to a `.tex` file, respond with the prediction of
+        `BuildHistory.predict` for its configured LaTeX command, which is
+        empty when the history is unavailable.
+        """
+        tex_file_path = os.path.join(self.root_dir, path.strip('/'))
+        c = LatexConfig(config=self.config)
+
+        if not os.path.exists(tex_file_path):
+            self.set_status(403)
+            out = f"Request cannot be completed; no file at `{tex_file_path}`."
+        elif os.path.splitext(tex_file_path)[1] != '.tex':
+            self.set_status(400)
+            out = (f"The file at `{tex_file_path}` does not end with .tex. "
+                    "Build history is only kept for files ending with .tex.")
+        else:
+            engine = c.manual_cmd_args[0] if c.manual_cmd_args else c.latex_command
+            prediction = yield predict_build(self.history, tex_file_path,
+                                             engine, self.log)
+            out = json.dumps(prediction)
+        self.finish(out)
@@ -20,7 +20,7 @@ class LatexSynctexHandler(APIHandler):
         self.root_dir = root_dir
 
 
-    def build_synctex_cmd(self, base_name, ext):
+    def build_synctex_cmd(self, base_name, ext, pdf_name=None):
         """
         Builds the command which will be used to call SyncTeX.
         If given a `.tex` it will build a forward synchronization command.
@@ -35,6 +35,11 @@ class LatexSynctexHandler(APIHandler):
         ext: string
             The extension of the file, either ".pdf" or ".tex"
 
+        pdf_name: string or None, optional
+            For a ".tex" file, the name of the pdf file, without the
+            extension, if it is not named after the ".tex" file, e.g. for
+            a file `\\include`d in another document. Defaults to None.
+
         returns:
             A tuple of (cmd, pos), where cmd is a tuple of string commands
             to be given to the SyncTeX subprocess, and pos is a dictionary
@@ -57,7 +62,7 @@ class LatexSynctexHandler(APIHandler):
                 'line': self.get_query_argument('line', default='1'),
                 'column': self.get_query_argument('column', default='1'),
                 }
-            cmd = self.build_synctex_view_cmd(base_name, pos)
+            cmd = self.build_synctex_view_cmd(base_name, pos, pdf_name)
 
         return (cmd, pos)
 
@@ -90,7 +95,7 @@ class LatexSynctexHandler(APIHandler):
 
         return cmd
 
-    def build_synctex_view_cmd(self, tex_name, pos):
+    def build_synctex_view_cmd(self, tex_name, pos, pdf_name=None):
         """Builds tuple that will be used to call the synctex view shell command.
 
         Parameters
@@ -102,12 +107,16 @@ class LatexSynctexHandler(APIHandler):
             A dictionary containing the position in the tex file
             document to map.
 
+        pdf_name: string or None, optional
+            This is the name of the pdf file, without the extension.
+            Defaults to the name of the tex file.
+
         returns:
             A tuple of of string commands to be given to the SyncTeX subprocess
 
         """
         c = LatexConfig(config=self.config)
-        pdf_path = os.path.join(self.root_dir, tex_name+".pdf")
+        pdf_path = os.path.join(self.root_dir, (pdf_name or tex_name)+".pdf")
         tex_path = os.path.join(self.root_dir, tex_name+".tex")
 
         cmd = (
@@ -170,9 +179,14 @@ class LatexSynctexHandler(APIHandler):
             document, the user should give `page`, `x`, and `y` in the query string,
             where `x` and `y` are a position on the page from the top left corner
             in dots (where the page is assumed to be 72 dpi).
+            A `.tex` file which is part of another document, such as an
+            `\\include`d chapter, is mapped to the PDF of that document
+            given by the `pdf` query argument.
 
         returns:
-            A JSON object containing the mapped position.
+            A JSON object containing the mapped position. For reverse
+            synchronization, it also contains the `input` file of the
+            position, relative to the root directory, if SyncTeX gave one.
         """
         # Parse the path into the base name and extension of the file
         relative_file_path = str(Path(path.strip('/')))
@@ -180,6 +194,13 @@ class LatexSynctexHandler(APIHandler):
         full_file_path = os.path.join(self.root_dir, relative_file_path)
         workdir = os.path.dirname(full_file_path)
         base_name, ext = os.path.splitext(os.path.basename(full_file_path))
+        relative_pdf_base_path = None
+        pdf = self.get_query_argument('pdf', default=None)
+        if pdf is not None and ext == '.tex':
+            relative_pdf_base_path = os.path.splitext(str(Path(pdf.strip('/'))))[0]
+            full_pdf_path = os.path.join(self.root_dir, relative_pdf_base_path)
+            workdir = os.path.dirname(full_pdf_path)
+            base_name = os.path.basename(full_pdf_path)
 
         if not os.path.exists(full_file_path):
             self.set_status(403)
@@ -192,10 +213,15 @@ class LatexSynctexHandler(APIHandler):
             out = (f"The file `{ext}` does not end with .tex of .pdf. "
                     "You can only run SyncTex on a file ending with .tex or .pdf.")
         else:
-            cmd, pos = self.build_synctex_cmd(relative_base_path, ext)
+            cmd, pos = self.build_synctex_cmd(relative_base_path, ext,
+                                              relative_pdf_base_path)
 
             out = yield self.run_synctex(cmd)
-            out = json.dumps(parse_synctex_response(out, pos))
+            result = parse_synctex_response(out, pos)
+            if 'input' in result:
+                result['input'] = Path(os.path.relpath(
+                    os.path.join(workdir, result['input']), self.root_dir)).as_posix()
+            out = json.dumps(result)
         self.finish(out)
 
 def parse_synctex_response(response, pos):
@@ -212,7 +238,8 @@ def parse_synctex_response(response, pos):
         The position that was input to SyncTeX
 
     returns:
-        A dictionary with the parsed response.
+        A dictionary with the parsed response. If SyncTeX names the input
+        file of the position, it is included as `input`.
 
     """
     fields = ["line", "column", "page", "x", "y"]
@@ -230,4 +257,8 @@ def parse_synctex_response(response, pos):
             fields.remove(key)
     for f in fields:
         result[f] = pos[f]
+    # The input path is case sensitive, so it is read from the raw response.
+    input_match = re.search(r'^Input:(.*?)\r?$', match.group(1), flags=re.MULTILINE)
+    if input_match is not None:
+        result['input'] = input_match.group(1)
     return result
@@ -1,10 +1,13 @@
 """ JupyterLab LaTex : live LaTeX editing for JupyterLab """
 
-import subprocess, sys
+import os, re, subprocess, sys
 
 from tornado import gen
 from tornado.process import Subprocess, CalledProcessError
 
+_comment = re.compile(r'(?<!\\)%.*')
+_input = re.compile(r'\\(input|include)\{([^}]+)\}')
+
 @gen.coroutine
 def run_command_sync(cmd):
     """
@@ -60,3 +63,71 @@ if sys.platform == 'win32':
     run_command = run_command_sync
 else:
     run_command = run_command_async
+
+def tex_path(name, workdir='.'):
+    """
+    The absolute path of a file named in `\\input` or `\\include`, which
+    LaTeX resolves against the directory it runs in, adding `.tex` when the
+    name has no extension.
+    """
+    path = os.path.join(workdir, name.strip())
+    if not os.path.splitext(path)[1]:
+        path += '.tex'
+    return os.path.abspath(path)
+
+def mask_comments(source):
+    """
+    Blank out the comments of LaTeX source, keeping every other character
+    at its offset.
+    """
+    return _comment.sub(lambda m: ' ' * len(m.group(0)), source)
+
+def walk_tex(tex_file_path, workdir='.', includeonly=None, start=0, end=None,
+             depth=0, seen=None):
+    """
+    Read a `.tex` file and, recursively, the files it `\\input`s or
+    `\\include`s.
+
+    Parameters
+    ----------
+    tex_file_path: string
+        The path to the `.tex` file.
+
+    workdir: string, optional
+        The directory LaTeX runs in, against which included paths are
+        resolved (the default is '.').
+
+    includeonly: list of strings or None, optional
+        If given, the `\\include`d units not in this list are skipped, as
+        with LaTeX's `\\includeonly`. Defaults to None.
+
+    start, end: int or None, optional
+        Only the part of the first file between these offsets is read.
+
+    returns:
+        A generator of (path, raw, masked) tuples, one per file, where raw
+        is the content of the file and masked is the same content with its
+        comments, and anything outside `start` and `end`, blanked out.
+    """
+    seen = set() if seen is None else seen
+    path = os.path.abspath(tex_file_path)
+    seen.add(path)
+    with open(path, encoding='utf-8', errors='replace') as f:
+        raw = f.read()
+    masked = mask_comments(raw)
+    if start or end is not None:
+        blank = lambda text: re.sub(r'[^\n]', ' ', text)
+        masked = (blank(masked[:start]) + masked[start:end]
+                  + blank(masked[end:] if end is not None else ''))
+    yield (path, raw, masked)
+    if depth >= 16:
+        return
+    for match in _input.finditer(masked):
+        name = match.group(2).strip()
+        if (includeonly is not None and match.group(1) == 'include'
+                and name not in includeonly):
+            continue
+        child = tex_path(name, workdir)
+        if child not in seen and os.path.isfile(child):
+            yield from walk_tex(child, workdir, includeonly, depth=depth + 1,
+                                seen=seen)
@@ -14,6 +14,7 @@ import {
   showErrorMessage,
   ICommandPalette,
   InputDialog,
+  Notification,
   ToolbarButton
 } from '@jupyterlab/apputils';
 
@@ -27,7 +28,7 @@ import { DocumentRegistry, IDocumentWidget } from '@jupyterlab/docregistry';
 
 import { FileEditor, IEditorTracker } from '@jupyterlab/fileeditor';
 
-import { ServerConnection } from '@jupyterlab/services';
+import { Contents, ServerConnection } from '@jupyterlab/services';
 
 import { ISettingRegistry } from '@jupyterlab/settingregistry';
 
@@ -102,6 +103,11 @@ namespace CommandIDs {
    */
   export const synctexView = 'latex:synctex-view';
 
+  /**
+   * Build the whole document of a LaTeX preview.
+   */
+  export const fullBuild = 'latex:full-build';
+
   /**
    * Create new latex file
    */
@@ -122,6 +128,87 @@ type ISynctexViewOptions = CodeEditor.IPosition;
  */
 type ISynctexEditOptions = PDFJSViewer.IPosition;
 
+/**
+ * The result of a SyncTeX edit command, with the file
+ * containing the position if it is known.
+ */
+type ISynctexEditResult = ISynctexViewOptions & { input?: string };
+
+/**
+ * A cursor position in a `.tex` file.
+ */
+interface ILatexCursor {
+  /**
+   * The path of the file, relative to the server root.
+   */
+  path: string;
+
+  /**
+   * The one-based line of the cursor.
+   */
+  line: number;
+}
+
+/**
+ * The options for a LaTeX build request.
+ */
+interface ILatexBuildOptions {
+  /**
+   * Whether to keep the auxiliary files, so that later builds
+   * can compile only the `\include`d file around the cursor.
+   */
+  keepAux?: boolean;
+
+  /**
+   * The cursor, whose enclosing `\include`d file is
+   * the only one compiled if possible.
+   */
+  cursor?: ILatexCursor;
+}
+
+/**
+ * What a LaTeX build request built: the `full` document, a single
+ * `\include`d `unit`, or nothing when the build was `skipped` because
+ * the cursor is in a file that is not part of the document.
+ */
+type LatexBuildKind = 'full' | 'unit' | 'skipped';
+
+/**
+ * The predicted next build of a `.tex` document, from its build history.
+ */
+interface ILatexBuildPrediction {
+  /**
+   * The number of recorded builds.
+   */
+  builds: number;
+
+  /**
+   * The expected duration of the build, in seconds.
+   */
+  duration: number | null;
+
+  /**
+   * The number of LaTeX passes that will be run.
+   */
+  passes: number | null;
+
+  /**
+   * Whether BibTeX is expected to run.
+   */
+  bibtex: boolean | null;
+
+  /**
+   * Whether the last build succeeded.
+   */
+  success: boolean | null;
+}
+
+/**
+ * Builds which are expected to take at least this long, in seconds,
+ * show their estimated duration while they run.
+ */
+const ETA_THRESHOLD = 5;
+
 /**
  * The JupyterFrontEnd plugin for the LaTeX extension.
  */
@@ -149,15 +236,51 @@ const latexPlugin: JupyterFrontEndPlugin<void> = {
  *
  * @param settings - the settings for the current notebook server.
  *
- * @returns a Promise resolved with the text response.
+ * @param options - the options for building part of the document.
+ *
+ * @returns a Promise resolved with what was built.
  */
 function latexBuildRequest(
   path: string,
   synctex: boolean,
-  settings: ServerConnection.ISettings
-): Promise<any> {
+  settings: ServerConnection.ISettings,
+  options: ILatexBuildOptions = {}
+): Promise<LatexBuildKind> {
   let fullUrl = URLExt.join(settings.baseUrl, 'latex', 'build', path);
   fullUrl += `?synctex=${synctex ? 1 : 0}`;
+  if (options.keepAux) {
+    fullUrl += '&keep_aux=1';
+  }
+  if (options.cursor) {
+    fullUrl +=
+      `&cursor_file=${encodeURIComponent(options.cursor.path)}` +
+      `&cursor_line=${options.cursor.line}`;
+  }
+
+  return ServerConnection.makeRequest(fullUrl, {}, settings).then(response => {
+    if (response.status !== 200) {
+      return response.text().then(data => {
+        throw new ServerConnection.ResponseError(response, data);
+      });
+    }
+    return (response.headers.get('X-LaTeX-Build') || 'full') as LatexBuildKind;
+  });
+}
+
+/**
+ * Make a request to the notebook server LaTeX build history endpoint.
+ *
+ * @param path - the path to the .tex file.
+ *
+ * @param settings - the settings for the current notebook server.
+ *
+ * @returns a Promise resolved with the predicted next build.
+ */
+function latexHistoryRequest(
+  path: string,
+  settings: ServerConnection.ISettings
+): Promise<ILatexBuildPrediction> {
+  const fullUrl = URLExt.join(settings.baseUrl, 'latex', 'history', path);
 
   return ServerConnection.makeRequest(fullUrl, {}, settings).then(response => {
     if (response.status !== 200) {
@@ -165,7 +288,7 @@ function latexBuildRequest(
         throw new ServerConnection.ResponseError(response, data);
       });
     }
-    return response.text();
+    return response.json() as Promise<ILatexBuildPrediction>;
   });
 }
 
@@ -182,7 +305,7 @@ function synctexEditRequest(
   path: string,
   pos: ISynctexEditOptions,
   settings: ServerConnection.ISettings
-): Promise<ISynctexViewOptions> {
+): Promise<ISynctexEditResult> {
   let url = URLExt.join(settings.baseUrl, 'latex', 'synctex', path);
   url += `?page=${pos.page}&x=${pos.x}&y=${pos.y}`;
 
@@ -195,8 +318,9 @@ function synctexEditRequest(
     return response.json().then(json => {
       return {
         line: parseInt(json.line, 10),
-        column: parseInt(json.column, 10)
-      } as ISynctexViewOptions;
+        column: parseInt(json.column, 10),
+        input: json.input
+      } as ISynctexEditResult;
     });
   });
 }
@@ -208,15 +332,22 @@ function synctexEditRequest(
  *
  * @param settings - the settings for the current notebook server.
  *
+ * @param pdf - the path to the .pdf file of the document, when the
+ *   .tex file is part of another document, such as an `\include`d file.
+ *
  * @returns a Promise resolved with the JSON response.
  */
 function synctexViewRequest(
   path: string,
   pos: ISynctexViewOptions,
-  settings: ServerConnection.ISettings
+  settings: ServerConnection.ISettings,
+  pdf?: string
 ): Promise<ISynctexEditOptions> {
   let url = URLExt.join(settings.baseUrl, 'latex', 'synctex', path);
   url += `?line=${pos.line}&column=${pos.column}`;
+  if (pdf) {
+    url += `&pdf=${encodeURIComponent(pdf)}`;
+  }
 
   return ServerConnection.makeRequest(url, {}, settings).then(response => {
     if (response.status !== 200) {
@@ -271,6 +402,8 @@ function activateLatexPlugin(
   });
 
   let synctex = true;
+  let chapterBuild = false;
+  let fullBuildIdle = 10;
 
   // Settings for the notebook server.
   const serverSettings = ServerConnection.makeSettings();
@@ -323,12 +456,27 @@ function activateLatexPlugin(
       // SyncTeX's column/x mapping seems to be very unreliable.
       // We get better results by only trying to sync the line/y position.
       synctexEditRequest(s.context.path, { ...pos, x: 0 }, serverSettings).then(
-        (view: ISynctexViewOptions) => {
+        (view: ISynctexEditResult) => {
           // SyncTex line is one-based, so subtract 1.
           const cursor = { line: view.line - 1, column: 0 };
-          (
-            widget as IDocumentWidget<FileEditor>
-          ).content.editor.setCursorPosition(cursor);
+          const mainPath = app.serviceManager.contents.localPath(
+            texContext!.path
+          );
+          // The position may be in an `\include`d file.
+          if (view.input && view.input !== mainPath) {
+            Private.mainFiles.set(view.input, texContext!.path);
+          }
+          const target =
+            view.input && view.input !== mainPath
+              ? manager.openOrReveal(view.input)
+              : widget;
+          if (target && target.content instanceof FileEditor) {
+            // A newly opened file can only be scrolled once it is loaded.
+            const editor = target.content.editor;
+            void target.context.ready.then(() => {
+              editor.setCursorPosition(cursor);
+            });
+          }
         }
       );
     };
@@ -360,39 +508,158 @@ function activateLatexPlugin(
       errorPanel.text = err.message;
     };
 
-    // Hook up an event listener for when the '.tex' file is saved.
-    const onFileChanged = () => {
+    // A full build scheduled after building a single `\include`d file.
+    let fullBuildTimer: number | null = null;
+    // The build requested while another one was running, if any.
+    let queued: { cursor?: ILatexCursor } | null = null;
+
+    // Build the document, or only the `\include`d file around the cursor.
+    const build = (cursor?: ILatexCursor): Promise<void> => {
       if (pending) {
+        // Run one more build afterwards. Saves of different files
+        // are merged into a build of the whole document.
+        queued =
+          !queued || (queued.cursor && cursor?.path === queued.cursor.path)
+            ? { cursor }
+            : {};
         return Promise.resolve(void 0);
       }
       pending = true;
+      const next = () => {
+        pending = false;
+        if (queued) {
+          const request = queued;
+          queued = null;
+          void build(request.cursor);
+        }
+      };
+      const clearFullBuild = () => {
+        if (fullBuildTimer !== null) {
+          window.clearTimeout(fullBuildTimer);
+          fullBuildTimer = null;
+        }
+      };
 
       /** Get the local file path without any drive prefix potentially added by
        * other extensions like jupyter-collaboration
        */
       const localPath = app.serviceManager.contents.localPath(texContext!.path);
+      const options: ILatexBuildOptions = chapterBuild
+        ? { keepAux: true, cursor }
+        : {};
+      // Without a cursor, the whole document is built.
+      if (!options.cursor) {
+        clearFullBuild();
+      }
 
-      return latexBuildRequest(localPath, synctex, serverSettings)
-        .then(() => {
+      // Show the estimated duration of long builds while they run.
+      let etaNotification: string | null = null;
+      latexHistoryRequest(localPath, serverSettings)
+        .then(prediction => {
+          if (
+            pending &&
+            !options.cursor &&
+            prediction.duration !== null &&
+            prediction.duration >= ETA_THRESHOLD
+          ) {
+            etaNotification = Notification.emit(
+              `Compiling ${baseName}.tex, ` +
+                `about ${Math.round(prediction.duration)} s`,
+              'in-progress',
+              { autoClose: false }
+            );
+          }
+        })
+        .catch(() => {
+          // The estimate is optional; ignore failures.
+        });
+      const dismissEta = () => {
+        if (etaNotification) {
+          Notification.dismiss(etaNotification);
+          etaNotification = null;
+        }
+      };
+
+      return latexBuildRequest(localPath, synctex, serverSettings, options)
+        .then(kind => {
+          dismissEta();
+          if (kind === 'skipped') {
+            next();
+            return;
+          }
+          // Forward search from an included file uses this document.
+          if (options.cursor && options.cursor.path !== localPath) {
+            Private.mainFiles.set(options.cursor.path, texContext!.path);
+          }
+          clearFullBuild();
+          // Build the whole document once editing pauses.
+          if (kind === 'unit' && fullBuildIdle > 0) {
+            fullBuildTimer = window.setTimeout(() => {
+              fullBuildTimer = null;
+              void build();
+            }, fullBuildIdle * 1000);
+          }
           // Read the pdf file contents from disk.
           pdfContext ? pdfContext.revert() : findOpenOrRevealPDF();
           if (errorPanel) {
             errorPanel.close();
           }
-          pending = false;
+          next();
         })
         .catch(err => {
+          dismissEta();
           // If there was an error, show the error panel
           // with the error log.
           if (!errorPanel) {
             errorPanelInit(err);
           }
-          pending = false;
+          next();
         });
     };
 
+    // Hook up an event listener for when the '.tex' file is saved.
+    const onFileChanged = () => {
+      const editor = (widget as IDocumentWidget<FileEditor>).content.editor;
+      return build({
+        path: app.serviceManager.contents.localPath(texContext!.path),
+        line: editor.getCursorPosition().line + 1
+      });
+    };
+
     texContext.fileChanged.connect(onFileChanged);
 
+    // When building `\include`d files separately, hook up an event listener
+    // for when the other '.tex' files next to the document are saved.
+    const onContentsChanged = (
+      sender: Contents.IManager,
+      change: Contents.IChangedArgs
+    ) => {
+      if (!chapterBuild || change.type !== 'save' || !change.newValue?.path) {
+        return;
+      }
+      const contents = app.serviceManager.contents;
+      const path = contents.localPath(change.newValue.path);
+      const mainPath = contents.localPath(texContext!.path);
+      const mainDir = PathExt.dirname(mainPath);
+      if (
+        path === mainPath ||
+        PathExt.extname(path) !== '.tex' ||
+        (mainDir !== '' && !path.startsWith(mainDir + '/'))
+      ) {
+        return;
+      }
+      const editor = editorTracker.find(
+        w => contents.localPath(w.context.path) === path
+      );
+      const line = editor
+        ? editor.content.editor.getCursorPosition().line + 1
+        : 1;
+      void build({ path, line });
+    };
+
+    app.serviceManager.contents.fileChanged.connect(onContentsChanged);
+    Private.fullBuilds.set(texContext.path, () => build());
+
     // Run an initial latexRequest so that the appropriate files exist,
     // then open them.
     onFileChanged().then(() => {
@@ -406,10 +673,21 @@ function activateLatexPlugin(
         return;
       }
       Private.previews.delete(texContext.path);
+      Private.fullBuilds.delete(texContext.path);
+      Private.mainFiles.forEach((mainPath, path) => {
+        if (mainPath === texContext.path) {
+          Private.mainFiles.delete(path);
+        }
+      });
+      if (fullBuildTimer !== null) {
+        window.clearTimeout(fullBuildTimer);
+        fullBuildTimer = null;
+      }
       if (errorPanel) {
         errorPanel.close();
       }
       texContext.fileChanged.disconnect(onFileChanged);
+      app.serviceManager.contents.fileChanged.disconnect(onContentsChanged);
       state.save(id, { paths: Array.from(Private.previews) });
     };
 
@@ -951,6 +1229,9 @@ function activateLatexPlugin(
         // Get the new value of the synctex setting.
         const val = settings.get('synctex').composite as boolean | null;
         synctex = val === true || val === false ? val : true;
+        chapterBuild = settings.get('chapterBuild').composite === true;
+        const idle = settings.get('fullBuildIdle').composite as number | null;
+        fullBuildIdle = typeof idle === 'number' ? idle : 10;
         // Trash any existing synctex commands
         disposables.dispose();
 
@@ -986,6 +1267,27 @@ function activateLatexPlugin(
     label: 'Show LaTeX Preview'
   });
 
+  commands.addCommand(CommandIDs.fullBuild, {
+    execute: () => {
+      const widget = editorTracker.currentWidget;
+      const fullBuild = widget && Private.fullBuilds.get(widget.context.path);
+      if (fullBuild) {
+        return fullBuild();
+      }
+    },
+    isEnabled: hasWidget,
+    isVisible: () => {
+      const widget = editorTracker.currentWidget;
+      return !!widget && Private.fullBuilds.has(widget.context.path);
+    },
+    label: 'Build Full LaTeX Document'
+  });
+
+  app.contextMenu.addItem({
+    command: CommandIDs.fullBuild,
+    selector: '.jp-FileEditor'
+  });
+
   const command = CommandIDs.createNew;
   const command_latex_preview = CommandIDs.openLatexPreview;
   commands.addCommand(command, {
@@ -1056,6 +1358,12 @@ function addSynctexCommands(
   const hasPDFWidget = () => !!pdfTracker.currentWidget;
   const hasEditorWidget = () => !!editorTracker.currentWidget;
 
+  // The path of the previewed document a .tex file belongs to, if any.
+  const documentPath = (path: string) =>
+    Private.previews.has(path)
+      ? path
+      : Private.mainFiles.get(app.serviceManager.contents.localPath(path));
+
   // Add the command for the PDF-to-editor mapping.
   disposables.add(
     app.commands.addCommand(CommandIDs.synctexEdit, {
@@ -1117,19 +1425,26 @@ function addSynctexCommands(
           // SyncTex uses one-based indexing.
           pos = { line: pos.line + 1, column: pos.column + 1 };
 
+          // An `\include`d file is shown in the PDF of its document.
+          const texFilePath =
+            documentPath(widget.context.path) || widget.context.path;
+          const baseName = PathExt.basename(texFilePath, '.tex');
+          const dirName = PathExt.dirname(texFilePath);
+          const pdfFilePath = PathExt.join(dirName, baseName + '.pdf');
+
           // Request the synctex position for the PDF
           return synctexViewRequest(
             widget.context.path,
             pos,
-            serverSettings
+            serverSettings,
+            texFilePath === widget.context.path
+              ? undefined
+              : app.serviceManager.contents.localPath(pdfFilePath)
           ).then((edit: ISynctexEditOptions) => {
             if (!widget) {
               return;
             }
             // Find the right pdf widget.
-            const baseName = PathExt.basename(widget.context.path, '.tex');
-            const dirName = PathExt.dirname(widget.context.path);
-            const pdfFilePath = PathExt.join(dirName, baseName + '.pdf');
             const pdfWidget = pdfTracker.find(
               pdf => pdf.context.path === pdfFilePath
             );
@@ -1145,7 +1460,7 @@ function addSynctexCommands(
       isEnabled: hasEditorWidget,
       isVisible: () => {
         const widget = editorTracker.currentWidget;
-        return !!widget && Private.previews.has(widget.context.path);
+        return !!widget && !!documentPath(widget.context.path);
       },
       label: 'Scroll PDF to Cursor'
     })
@@ -1435,6 +1750,17 @@ namespace Private {
    */
   export const previews = new Set<string>();
 
+  /**
+   * Full builds of the currently active LaTeX previews, by path.
+   */
+  export const fullBuilds = new Map<string, () => Promise<void>>();
+
+  /**
+   * The previewed documents of `\include`d files, by the local path of
+   * the included file.
+   */
+  export const mainFiles = new Map<string, string>();
+
   /**
    * Create an error panel widget.
    */